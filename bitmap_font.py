@@ -0,0 +1,165 @@
+"""NES Sprite Reader - A tiny bitmapped font for numbering tiles.
+
+Sprite tiles are only 8x8 pixels, so regular fonts are illegible when used to
+label them. This is a 3x5 pixel font containing just the hexadecimal digits,
+which is enough to label every tile with its index.
+
+The glyphs are kept as rows of palette indices, from which labels are assembled
+using cached rows of pairs of glyphs (neighbouring tiles share most of their
+digits). Writers that don't work with Images (see png_writer.py) use those
+rows directly; to draw onto an Image, they are turned into a mask, so that a
+whole row of labels is drawn with a single paste rather than one per glyph.
+"""
+
+import string
+
+from PIL import Image
+
+
+GLYPH_WIDTH = 3
+GLYPH_HEIGHT = 5
+
+# Horizontal space between glyphs.
+GLYPH_SPACING = 1
+
+GLYPHS = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '001', '010', '010'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+    'a': ('010', '101', '111', '101', '101'),
+    'b': ('110', '101', '110', '101', '110'),
+    'c': ('011', '100', '100', '100', '011'),
+    'd': ('110', '101', '101', '101', '110'),
+    'e': ('111', '100', '110', '100', '111'),
+    'f': ('111', '100', '110', '100', '100'),
+}
+
+
+def GetLabelWidth(length):
+  """Calculate the width in pixels of a label.
+
+  Args:
+    length: The number of characters in the label.
+
+  Returns:
+    The width of the label (including the spacing after each glyph).
+  """
+  return length * (GLYPH_WIDTH + GLYPH_SPACING)
+
+
+class GlyphAtlas(object):
+  """The font's glyphs, cached as rows for drawing labels."""
+
+  def __init__(self):
+    # Glyph rows as palette indices, keyed on (on_index, off_index).
+    self._glyph_rows = {}
+    # Rows of pairs of glyphs, keyed on (on_index, off_index) and then the pair.
+    self._pair_rows = {}
+
+  def DrawLabel(self, img, text, color, x_val, y_val):
+    """Draw a label.
+
+    Args:
+      img: The Image instance to draw on.
+      text: The label (hexadecimal digits only).
+      color: The color of the label (e.g. an (R, G, B) tuple).
+      x_val: The x-coordinate of the top left corner of the label.
+      y_val: The y-coordinate of the top left corner of the label.
+    """
+    self.DrawLabels(img, [text], color, x_val, y_val, GetLabelWidth(len(text)))
+
+  def DrawLabels(self, img, labels, color, x_val, y_val, spacing):
+    """Draw a row of labels with a single paste.
+
+    Args:
+      img: The Image instance to draw on.
+      labels: The labels (hexadecimal digits only), from left to right.
+      color: The color of the labels (e.g. an (R, G, B) tuple).
+      x_val: The x-coordinate of the top left corner of the first label.
+      y_val: The y-coordinate of the top left corner of the labels.
+      spacing: The distance in pixels from the start of one label to the start
+          of the next (at least the width of the labels).
+    """
+    label_rows = [self.GetLabelRows(text, 255, 0) for text in labels]
+    if not label_rows:
+      return
+    width = spacing * len(labels)
+    mask = Image.frombytes('L', (width, GLYPH_HEIGHT), ''.join(
+        ''.join(rows[line].ljust(spacing, '\x00') for rows in label_rows)
+        for line in xrange(GLYPH_HEIGHT)))
+    img.paste(
+        color, (x_val, y_val, x_val + width, y_val + GLYPH_HEIGHT), mask)
+
+  def GetGlyphRows(self, on_index, off_index):
+    """Return the glyphs as rows of palette indices.
+
+    Args:
+      on_index: The palette index (0-255) of the glyph pixels.
+      off_index: The palette index (0-255) of the background pixels.
+
+    Returns:
+      A dictionary mapping each character to a list of GLYPH_HEIGHT strings,
+          each GLYPH_WIDTH + GLYPH_SPACING bytes long.
+    """
+    key = (on_index, off_index)
+    glyph_rows = self._glyph_rows.get(key)
+    if glyph_rows is None:
+      on, off = chr(on_index), chr(off_index)
+      glyph_rows = {
+          character: [
+              row.translate(string.maketrans('01', off+on)) +
+              off*GLYPH_SPACING
+              for row in rows
+          ]
+          for character, rows in GLYPHS.iteritems()
+      }
+      self._glyph_rows[key] = glyph_rows
+    return glyph_rows
+
+  def GetLabelRows(self, text, on_index, off_index):
+    """Return a label as rows of palette indices.
+
+    Labels are assembled from cached pairs of glyphs, as neighbouring tiles
+    share most of their digits.
+
+    Args:
+      text: The label (hexadecimal digits only).
+      on_index: The palette index (0-255) of the glyph pixels.
+      off_index: The palette index (0-255) of the background pixels.
+
+    Returns:
+      A list of GLYPH_HEIGHT strings, each GetLabelWidth(len(text)) bytes long.
+    """
+    key = (on_index, off_index)
+    pair_rows = self._pair_rows.setdefault(key, {})
+    rows = [''] * GLYPH_HEIGHT
+    for start in xrange(0, len(text), 2):
+      pair = text[start:start+2]
+      rows_for_pair = pair_rows.get(pair)
+      if rows_for_pair is None:
+        glyph_rows = self.GetGlyphRows(on_index, off_index)
+        rows_for_pair = [
+            ''.join(glyph_rows[character][line] for character in pair)
+            for line in xrange(GLYPH_HEIGHT)
+        ]
+        pair_rows[pair] = rows_for_pair
+      rows = [row + pair_row for row, pair_row in zip(rows, rows_for_pair)]
+    return rows
+
+
+_ATLAS = None
+
+
+def GetAtlas():
+  """Return the shared GlyphAtlas, rendering it the first time it is needed."""
+  global _ATLAS
+  if _ATLAS is None:
+    _ATLAS = GlyphAtlas()
+  return _ATLAS
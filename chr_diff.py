@@ -0,0 +1,204 @@
+"""NES Sprite Reader - Find the tiles that differ between two CHR ROMs.
+
+ROM hacks and revisions of a game usually only touch a small number of tiles,
+so rather than decoding every tile of both ROMs and comparing the results, the
+raw CHR data is compared directly:
+
+  1. Blocks of BLOCK_TILES tiles are compared as plain strings, skipping over
+     identical stretches of CHR at C speed.
+  2. Within a block that differs, each 16-byte tile is compared.
+  3. Only for tiles that differ are pixel changes counted. A pixel changes when
+     either of its two bits (one per plane) changes, so the number of changed
+     pixels in a row is popcount((a0 ^ b0) | (a1 ^ b1)).
+
+See example_reader.py for the general usage of NESSpriteReader.
+"""
+
+import nes_sprite_reader
+
+from PIL import Image
+
+
+TILE_SIZE = 16
+PLANE_SIZE = 8
+PIXELS_PER_TILE = 64
+
+# The number of tiles compared at once before narrowing down to single tiles.
+BLOCK_TILES = 64
+
+# Garish red for changed pixels.
+HIGHLIGHT_COLOR = (0xff, 0x00, 0x00)
+
+_POPCOUNT = [bin(value).count('1') for value in xrange(256)]
+
+
+def ReadCHR(file_path):
+  """Read just the CHR data of a ROM, without decoding any of its sprites.
+
+  Args:
+    file_path: The path to the .nes ROM.
+
+  Returns:
+    A string containing the ROM's CHR data.
+
+  Raises:
+    ValueError: The file is too short to have an iNES header.
+  """
+  with open(file_path, 'rb') as f:
+    _, _, chr_start, chr_length = nes_sprite_reader.GetSectionLayout(
+        f.read(nes_sprite_reader.HEADER_LENGTH))
+    f.seek(chr_start)
+    return f.read(chr_length)
+
+
+def CountChangedPixels(tile_a, tile_b):
+  """Count the pixels that differ between two (raw, 16-byte) tiles.
+
+  Args:
+    tile_a: The 16 bytes of the first tile.
+    tile_b: The 16 bytes of the second tile.
+
+  Returns:
+    The number of pixels (0-64) whose value differs.
+  """
+  a = bytearray(tile_a)
+  b = bytearray(tile_b)
+  return sum(
+      _POPCOUNT[(a[row] ^ b[row]) | (a[row+PLANE_SIZE] ^ b[row+PLANE_SIZE])]
+      for row in xrange(PLANE_SIZE))
+
+
+def ChangedPixelMask(tile_a, tile_b):
+  """Determine which pixels differ between two (raw, 16-byte) tiles.
+
+  Args:
+    tile_a: The 16 bytes of the first tile.
+    tile_b: The 16 bytes of the second tile.
+
+  Returns:
+    A list of 8 integers (one per row), where bit 7 represents the leftmost
+        pixel and a set bit means that the pixel changed.
+  """
+  a = bytearray(tile_a)
+  b = bytearray(tile_b)
+  return [
+      (a[row] ^ b[row]) | (a[row+PLANE_SIZE] ^ b[row+PLANE_SIZE])
+      for row in xrange(PLANE_SIZE)
+  ]
+
+
+def DiffCHR(chr_a, chr_b, first_tile=0):
+  """Find the tiles that differ between two regions of CHR data.
+
+  If one region is longer than the other, its extra tiles are reported as
+  having all of their pixels changed.
+
+  Args:
+    chr_a: A string of raw CHR data (e.g. NESSpriteReader.chr_data).
+    chr_b: Another string of raw CHR data.
+    first_tile: The tile index of the start of both regions, which is added to
+        every reported index.
+
+  Returns:
+    A list of (tile_index, changed_pixels) tuples, ordered by tile_index.
+  """
+  changes = []
+  common_length = min(len(chr_a), len(chr_b))
+  block_size = BLOCK_TILES * TILE_SIZE
+
+  for block_start in xrange(0, common_length, block_size):
+    block_end = min(block_start + block_size, common_length)
+    if chr_a[block_start:block_end] == chr_b[block_start:block_end]:
+      continue
+
+    for tile_start in xrange(block_start, block_end, TILE_SIZE):
+      tile_a = chr_a[tile_start:tile_start+TILE_SIZE]
+      tile_b = chr_b[tile_start:tile_start+TILE_SIZE]
+      if tile_a != tile_b:
+        changes.append((
+            first_tile + tile_start // TILE_SIZE,
+            CountChangedPixels(tile_a, tile_b),
+        ))
+
+  longest = max(len(chr_a), len(chr_b))
+  for tile_start in xrange(common_length, longest, TILE_SIZE):
+    changes.append((first_tile + tile_start // TILE_SIZE, PIXELS_PER_TILE))
+
+  return changes
+
+
+def DiffReaders(reader_a, reader_b):
+  """Find the tiles that differ between the CHR data of two NESSpriteReaders.
+
+  Args:
+    reader_a: The original NESSpriteReader.
+    reader_b: The modified NESSpriteReader.
+
+  Returns:
+    A list of (tile_index, changed_pixels) tuples (see DiffCHR).
+  """
+  return DiffCHR(reader_a.chr_data, reader_b.chr_data)
+
+
+def DiffLibrary(base_path, file_paths):
+  """Diff a collection of ROMs against a base ROM.
+
+  Only the CHR data of each ROM is read, so no sprites are decoded.
+
+  Args:
+    base_path: The path to the base .nes ROM.
+    file_paths: An iterable of paths to .nes ROMs (revisions, hacks, etc.).
+
+  Returns:
+    A dictionary of the form {file_path: changes}, where changes is a list of
+        (tile_index, changed_pixels) tuples (see DiffCHR).
+  """
+  base_chr = ReadCHR(base_path)
+  return {
+      file_path: DiffCHR(base_chr, ReadCHR(file_path))
+      for file_path in file_paths
+  }
+
+
+def DrawDiffSheet(reader_a, reader_b, changes, palette=None):
+  """Draw the changed tiles of two NESSpriteReaders side by side.
+
+  Each changed tile gets its own row of three tiles: the original tile, the
+  modified tile and the modified tile with its changed pixels highlighted.
+
+  Args:
+    reader_a: The original NESSpriteReader.
+    reader_b: The modified NESSpriteReader.
+    changes: A list of (tile_index, changed_pixels) tuples (see DiffCHR).
+    palette: A dictionary containing the palette data for the tiles.
+
+  Returns:
+    An Image instance containing the changed tiles.
+  """
+  height = max(len(changes), 1) * 8
+  img = Image.new('RGB', (3*8, height), 'white')
+
+  for row_index, (tile_index, _) in enumerate(changes):
+    y_val = row_index * 8
+    have_a = tile_index < len(reader_a.sprites)
+    have_b = tile_index < len(reader_b.sprites)
+    if have_a:
+      reader_a.DrawSprite(img, [[tile_index]], palette, x_val=0, y_val=y_val)
+    if have_b:
+      reader_b.DrawSprite(img, [[tile_index]], palette, x_val=8, y_val=y_val)
+      reader_b.DrawSprite(img, [[tile_index]], palette, x_val=16, y_val=y_val)
+
+    if have_a and have_b:
+      tile_start = tile_index * TILE_SIZE
+      mask = ChangedPixelMask(
+          reader_a.chr_data[tile_start:tile_start+TILE_SIZE],
+          reader_b.chr_data[tile_start:tile_start+TILE_SIZE])
+    else:
+      mask = [0xff] * PLANE_SIZE
+
+    for row, bits in enumerate(mask):
+      for col in xrange(8):
+        if bits & (0x80 >> col):
+          img.putpixel((16+col, y_val+row), HIGHLIGHT_COLOR)
+
+  return img
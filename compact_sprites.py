@@ -0,0 +1,184 @@
+"""NES Sprite Reader - Compact representations of tiles and sprites.
+
+Storing each decoded tile as a list of eight 8-character strings costs several
+hundred bytes of Python object overhead for just 64 pixels. A TileStore instead
+keeps every tile in one flat buffer with a single byte ('0'-'3') per pixel, 64
+bytes per tile. Indexing a TileStore still returns a tile as a list of 8 row
+strings, so it can be used anywhere a list of decoded tiles could be.
+
+Sprite definitions (such as those in roms/smb3/smb3_sprites.py) are nested
+tuples of tile indices, whose size used to be re-measured every time they were
+drawn. A Metasprite precomputes its width and height (and a flat array of its
+tile indices) once, while still iterating like the nested tuples it was built
+from. ConvertDefinitions converts all of the definitions in a module at once.
+"""
+
+import array
+
+
+TILE_SIZE = 16
+PIXELS_PER_TILE = 64
+
+# Flat tile arrays use this index for positions missing from short rows.
+NO_TILE = -1
+
+# Each bit of a byte spread out into its own hexadecimal digit (e.g. 0b101 ->
+# 0x101), so that 2*SPREAD[a] + SPREAD[b] formats as the row of pixel values
+# for the plane bytes a and b.
+_SPREAD = [int('{:08b}'.format(value), 16) for value in xrange(256)]
+
+
+def DecodeCHR(chr_data):
+  """Decode raw CHR data into one '0'-'3' character per pixel.
+
+  This produces exactly what NESSpriteReader.DecodeSprite does for each tile,
+  but without building any intermediate strings per pixel.
+
+  Args:
+    chr_data: A string of raw CHR data (16 bytes per tile).
+
+  Returns:
+    A string of 64 characters per tile, row by row.
+  """
+  values = bytearray(chr_data)
+  rows = []
+  for start in xrange(0, len(values) - TILE_SIZE + 1, TILE_SIZE):
+    for row in xrange(start, start + 8):
+      rows.append(
+          '{:08x}'.format(2*_SPREAD[values[row]] + _SPREAD[values[row+8]]))
+  return ''.join(rows)
+
+
+class TileStore(object):
+  """A list-like store of decoded tiles, kept in a single flat buffer.
+
+  Args:
+    data: An optional buffer of decoded tiles (64 bytes per tile, see
+        DecodeCHR). If not provided, the store starts out empty.
+    offset: The offset of the first tile in data.
+    count: The number of tiles in data (default: all of them).
+  """
+
+  __slots__ = ('_data', '_offset', '_count')
+
+  def __init__(self, data=None, offset=0, count=None):
+    self._data = bytearray() if data is None else data
+    self._offset = offset
+    if count is None:
+      count = (len(self._data) - offset) // PIXELS_PER_TILE
+    self._count = count
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in xrange(*index.indices(self._count))]
+    if index < 0:
+      index += self._count
+    if not 0 <= index < self._count:
+      raise IndexError('tile index out of range')
+    start = self._offset + index*PIXELS_PER_TILE
+    tile = str(self._data[start:start+PIXELS_PER_TILE])
+    return [tile[row:row+8] for row in xrange(0, PIXELS_PER_TILE, 8)]
+
+  def __setitem__(self, index, tile):
+    if index < 0:
+      index += self._count
+    if not 0 <= index < self._count:
+      raise IndexError('tile index out of range')
+    start = self._offset + index*PIXELS_PER_TILE
+    self._data[start:start+PIXELS_PER_TILE] = ''.join(tile)
+
+  def __iter__(self):
+    for index in xrange(self._count):
+      yield self[index]
+
+  def append(self, tile):
+    """Append a decoded tile (an iterable of 8 row strings)."""
+    self._data.extend(''.join(tile))
+    self._count += 1
+
+  def ExtendCHR(self, chr_data):
+    """Decode and append every tile in a string of raw CHR data."""
+    decoded = DecodeCHR(chr_data)
+    self._data.extend(decoded)
+    self._count += len(decoded) // PIXELS_PER_TILE
+
+  def ToString(self):
+    """Return the decoded tiles as a single string (64 bytes per tile)."""
+    start = self._offset
+    return str(self._data[start:start + self._count*PIXELS_PER_TILE])
+
+
+class Metasprite(object):
+  """A sprite made up of multiple tiles, with its size measured up front.
+
+  Iterating over a Metasprite yields its rows of tile indices, just like the
+  nested tuple it was built from, so it can be used anywhere those can.
+
+  Args:
+    rows: An iterable of iterables of tile indices (e.g. ((0, 1), (2, 3))).
+  """
+
+  __slots__ = ('rows', 'width', 'height', 'columns', 'tiles')
+
+  def __init__(self, rows):
+    self.rows = tuple(tuple(row) for row in rows)
+    self.columns = max(len(row) for row in self.rows) if self.rows else 0
+    self.width = self.columns * 8
+    self.height = len(self.rows) * 8
+
+    # Row-major tile indices, with short rows padded with NO_TILE (this is what
+    # NESSpriteReader.DrawSprite walks).
+    self.tiles = array.array('l', [
+        row[col] if col < len(row) else NO_TILE
+        for row in self.rows
+        for col in xrange(self.columns)
+    ])
+
+  def __iter__(self):
+    return iter(self.rows)
+
+  def __len__(self):
+    return len(self.rows)
+
+  def __getitem__(self, index):
+    return self.rows[index]
+
+  def __eq__(self, other):
+    if isinstance(other, Metasprite):
+      return self.rows == other.rows
+    return self.rows == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.rows)
+
+  def __repr__(self):
+    return 'Metasprite({!r})'.format(self.rows)
+
+
+def IsSpriteDefinition(value):
+  """Determine whether a value is a nested tuple of tile indices."""
+  return isinstance(value, tuple) and all(
+      isinstance(row, tuple) and
+      all(isinstance(tile, (int, long)) for tile in row)
+      for row in value)
+
+
+def ConvertDefinitions(namespace):
+  """Convert every sprite definition in a namespace into a Metasprite.
+
+  This is meant to be called at the bottom of a sprite definition module (see
+  roms/smb3/smb3_sprites.py) as ConvertDefinitions(globals()).
+
+  Args:
+    namespace: A dictionary (such as a module's globals()) whose upper case
+        entries that are nested tuples of tile indices will be converted.
+  """
+  for name, value in namespace.items():
+    if name.isupper() and IsSpriteDefinition(value):
+      namespace[name] = Metasprite(value)
@@ -0,0 +1,361 @@
+"""NES Sprite Reader - Run render jobs described by a JSON manifest.
+
+Instead of hard-coding which sprites to draw (as in example_reader.py), the
+ROMs, palettes, sprites and outputs can be listed in a manifest:
+
+    {
+      "roms": {
+        "smb3": {
+          "path": "./super_mario_3.nes",
+          "palettes": "roms.smb3.smb3_palettes.PALETTES",
+          "sprites": "roms.smb3.smb3_sprites"
+        }
+      },
+      "jobs": [
+        {
+          "output": "raccoon.bmp",
+          "rom": "smb3",
+          "sprite": "RACCOON_LEFT_RUN_2",
+          "palette": "regular_mario_palette"
+        },
+        {
+          "output": "block.bmp",
+          "rom": "smb3",
+          "block": [
+            [
+              ["GOOMBA", "tanooki_mario_palette"],
+              [[[60, 62], [61, 63]], "fire_mario_palette"]
+            ]
+          ]
+        }
+      ]
+    }
+
+Palettes are either the dotted name of a palette table (such as
+roms/smb3/smb3_palettes.py) or an inline list of [name, address] pairs, where
+addresses may be integers or hex strings. Sprites are either names from the
+ROM's sprite module or inline nested lists of tile indices. Relative paths are
+relative to the manifest.
+
+When run, every ROM is read once, each distinct (sprite, palette) pair is only
+rendered once no matter how many jobs use it, and the renders are spread over a
+pool of worker processes (which share a single decoded copy of each ROM's
+sprites, see shared_sprites.py). A fingerprint of the inputs of each output
+(the bytes of the tiles and the colors of the palettes it uses, plus its
+layout) is stored next to the manifest, so outputs whose inputs are unchanged
+are skipped on the next run.
+
+Usage:
+    python manifest_runner.py manifest.json [processes]
+"""
+
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+
+import nes_sprite_reader
+import shared_sprites
+
+from PIL import Image
+
+
+STATE_SUFFIX = '.state'
+
+# SharedSpriteReaders attached by the current (worker) process, keyed on name.
+_READERS = {}
+
+
+def _ResolveName(dotted_name):
+  """Import and return the object referred to by a dotted name.
+
+  Args:
+    dotted_name: A name such as 'roms.smb3.smb3_palettes.PALETTES'.
+
+  Returns:
+    The object the name refers to.
+  """
+  module_name, _, attribute = dotted_name.rpartition('.')
+  return getattr(importlib.import_module(module_name), attribute)
+
+
+def _ToTuple(value):
+  """Recursively convert (JSON) lists into (hashable) tuples."""
+  if isinstance(value, list):
+    return tuple(_ToTuple(item) for item in value)
+  return value
+
+
+def _ToAddress(value):
+  """Convert an integer or hex string into an address."""
+  if isinstance(value, basestring):
+    return int(value, 16)
+  return value
+
+
+class RomSpec(object):
+  """A ROM listed in a manifest.
+
+  Args:
+    name: The name of the ROM in the manifest.
+    spec: The manifest entry for the ROM (see the module docstring).
+    base_dir: The directory relative to which paths are resolved.
+  """
+
+  def __init__(self, name, spec, base_dir):
+    self.name = name
+    self.path = os.path.join(base_dir, spec['path'])
+
+    palettes = spec.get('palettes', ())
+    if isinstance(palettes, basestring):
+      palettes = _ResolveName(palettes)
+    self.palettes = tuple(
+        (str(palette_name), _ToAddress(address))
+        for palette_name, address in palettes)
+
+    sprites = spec.get('sprites')
+    self.sprite_module = (
+        importlib.import_module(sprites) if sprites else None)
+
+    # The reader is the only place the ROM is read; its CHR data and palettes
+    # are fingerprinted, and it is what gets shared with the workers.
+    self.reader = nes_sprite_reader.NESSpriteReader(self.path, self.palettes)
+
+  def GetSprite(self, sprite):
+    """Resolve a sprite given by name or as nested lists of tile indices.
+
+    Raises:
+      ValueError: The sprite name is not defined in the ROM's sprite module.
+    """
+    if isinstance(sprite, basestring):
+      if self.sprite_module is None or not hasattr(self.sprite_module, sprite):
+        raise ValueError(
+            'Sprite {} is not defined for ROM {}.'.format(sprite, self.name))
+      return getattr(self.sprite_module, sprite)
+    return _ToTuple(sprite)
+
+  def CheckRender(self, sprite, palette_name):
+    """Check that a (sprite, palette) pair can be rendered from the ROM.
+
+    Raises:
+      ValueError: The palette is unknown or a tile is not in the ROM.
+    """
+    if palette_name not in self.reader.palettes:
+      raise ValueError(
+          'Palette {} is not defined for ROM {}.'.format(
+              palette_name, self.name))
+    for row in sprite:
+      for tile in row:
+        if not 0 <= tile < len(self.reader.sprites):
+          raise ValueError(
+              'Tile {} is not in ROM {}.'.format(tile, self.name))
+
+  def Fingerprint(self, sprite, palette_name):
+    """Hash the raw bytes of the tiles and the colors of the palette."""
+    digest = hashlib.sha1(repr((sprite, palette_name)))
+    digest.update(repr(sorted(self.reader.palettes[palette_name].items())))
+    for row in sprite:
+      for tile in row:
+        digest.update(self.reader.chr_data[tile*16:tile*16+16])
+    return digest.hexdigest()
+
+
+def _GetReader(source):
+  """Return the reader for a render.
+
+  Args:
+    source: Either a NESSpriteReader, which is used as is, or the name of a
+        SharedSpriteStore to attach to (at most once per process).
+
+  Returns:
+    A NESSpriteReader (or SharedSpriteReader).
+  """
+  if not isinstance(source, basestring):
+    return source
+  reader = _READERS.get(source)
+  if reader is None:
+    reader = _READERS[source] = shared_sprites.SharedSpriteReader(source)
+  return reader
+
+
+def _RenderSprite(args):
+  """Render a single (sprite, palette) pair.
+
+  This runs in the worker processes, so the Image is returned as raw bytes.
+
+  Args:
+    args: A tuple of the form (key, source, sprite, palette_name), where
+        source identifies the ROM (see _GetReader).
+
+  Returns:
+    A tuple of the form (key, size, data), where data is the RGB pixel data.
+  """
+  key, source, sprite, palette_name = args
+  reader = _GetReader(source)
+  img = reader.DrawSprite(
+      img=None, sprites=sprite, palette=reader.palettes[palette_name])
+  return key, img.size, img.tobytes()
+
+
+class ManifestRunner(object):
+  """Execute the render jobs of a manifest.
+
+  Args:
+    manifest_path: The path to the JSON manifest.
+    processes: The number of worker processes to use (default: one per CPU).
+        If 1, everything is rendered in the current process.
+  """
+
+  def __init__(self, manifest_path, processes=None):
+    self.manifest_path = manifest_path
+    self.state_path = manifest_path + STATE_SUFFIX
+    self.processes = processes
+
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+
+    self.base_dir = base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    self.roms = {
+        name: RomSpec(name, spec, base_dir)
+        for name, spec in manifest['roms'].iteritems()
+    }
+
+    # Normalize every job into (output, rom name, sprite block).
+    self.jobs = []
+    for job in manifest['jobs']:
+      rom = self.roms[job['rom']]
+      if 'block' in job:
+        block = tuple(
+            tuple((rom.GetSprite(sprite), str(palette_name))
+                  for sprite, palette_name in row)
+            for row in job['block'])
+      else:
+        block = (((rom.GetSprite(job['sprite']), str(job['palette'])),),)
+
+      # Catch mistakes here, rather than partway through rendering.
+      for row in block:
+        for sprite, palette_name in row:
+          rom.CheckRender(sprite, palette_name)
+      self.jobs.append(
+          (os.path.join(base_dir, job['output']), rom.name, block))
+
+  def _LoadState(self):
+    """Load the fingerprints of the outputs from the last run."""
+    if not os.path.exists(self.state_path):
+      return {}
+    with open(self.state_path) as f:
+      return json.load(f)
+
+  def _SaveState(self, state):
+    """Save the fingerprints of the outputs."""
+    with open(self.state_path, 'w') as f:
+      json.dump(state, f, indent=2, sort_keys=True)
+
+  def _Fingerprint(self, rom_name, block):
+    """Fingerprint all of the inputs of a job."""
+    rom = self.roms[rom_name]
+    digest = hashlib.sha1(repr(block))
+    for row in block:
+      for sprite, palette_name in row:
+        digest.update(rom.Fingerprint(sprite, palette_name))
+    return digest.hexdigest()
+
+  def _Render(self, renders):
+    """Render the distinct (sprite, palette) pairs.
+
+    Args:
+      renders: A list of render arguments (see _RenderSprite).
+
+    Returns:
+      A dictionary mapping each render key to its Image.
+    """
+    if self.processes == 1 or len(renders) <= 1:
+      results = [_RenderSprite(args) for args in renders]
+    else:
+      # Share each ROM's decoded sprites with the workers rather than have
+      # them each read and decode their own copy.
+      stores = {}
+      for _, source, _, _ in renders:
+        if source not in stores:
+          stores[source] = shared_sprites.SharedSpriteStore(source)
+
+      pool = multiprocessing.Pool(self.processes)
+      try:
+        results = pool.map(
+            _RenderSprite,
+            [(key, stores[source].name, sprite, palette_name)
+             for key, source, sprite, palette_name in renders],
+            chunksize=16)
+      finally:
+        pool.close()
+        pool.join()
+        for store in stores.itervalues():
+          store.Close()
+
+    return {
+        key: Image.frombytes('RGB', size, data)
+        for key, size, data in results
+    }
+
+  def Run(self, force=False):
+    """Render every output whose inputs have changed since the last run.
+
+    Args:
+      force: If True, render every output regardless of the saved state.
+
+    Returns:
+      A list of the paths of the outputs that were written.
+    """
+    state = {} if force else self._LoadState()
+
+    stale = []
+    renders = {}
+    for output, rom_name, block in self.jobs:
+      # Outputs are saved relative to the manifest, so the state file can move
+      # along with it.
+      state_key = os.path.relpath(output, self.base_dir)
+      fingerprint = self._Fingerprint(rom_name, block)
+      if state.get(state_key) == fingerprint and os.path.exists(output):
+        continue
+      stale.append((output, state_key, rom_name, block, fingerprint))
+
+      rom = self.roms[rom_name]
+      for row in block:
+        for sprite, palette_name in row:
+          key = (rom_name, sprite, palette_name)
+          if key not in renders:
+            renders[key] = (key, rom.reader, sprite, palette_name)
+
+    # Save the fingerprints of whatever was written, even if a later output
+    # fails, so that those outputs are not rendered again.
+    try:
+      images = self._Render(renders.values())
+
+      for output, state_key, rom_name, block, fingerprint in stale:
+        img = Image.new('RGB', nes_sprite_reader.GetBlockSize(block), 'white')
+        for sprite, palette_name, x_val, y_val in (
+            nes_sprite_reader.GetBlockLayout(block)):
+          sprite_img = images[(rom_name, sprite, palette_name)]
+          width, height = sprite_img.size
+          img = nes_sprite_reader.MaybeEnlargeImage(
+              img, width, height, x_val, y_val)
+          img.paste(sprite_img, (x_val, y_val))
+        img.save(output)
+        state[state_key] = fingerprint
+    finally:
+      self._SaveState(state)
+
+    return [output for output, _, _, _, _ in stale]
+
+
+def main(argv):
+  """Run the manifest given on the command line."""
+  processes = int(argv[2]) if len(argv) > 2 else None
+  for output in ManifestRunner(argv[1], processes).Run():
+    print 'Wrote {}'.format(output)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -25,7 +25,11 @@ import itertools
 import math
 import sys
 
+import bitmap_font
+import compact_sprites
 import nes_palette
+import png_writer
+import tile_detector
 
 from PIL import Image
 from PIL import ImageDraw
@@ -41,6 +45,9 @@ SECTION_SIZE_FORMAT = (
 )
 
 
+# Use a garish green for labels for no good reason other than it is green.
+LABEL_COLOR = (0, 255, 0)
+
 DEFAULT_PALETTE = {
     '0': (0xff, 0xff, 0xff),
     '1': (0x75, 0x75, 0x75),
@@ -48,6 +55,11 @@ DEFAULT_PALETTE = {
     '3': (0x00, 0x00, 0x00),
 }
 
+# The iNES header, and the sizes of the PRG and CHR ROM banks it counts.
+HEADER_LENGTH = 16
+PRG_BANK_SIZE = 16384
+CHR_BANK_SIZE = 8192
+
 
 def ConvertToHex(bytes_):
   """Convert a series of bytes into their hexadecimal (integer) equivalent.
@@ -82,6 +94,28 @@ def CompositeSpriteValue(nibble_1, nibble_2):
   return ''.join(str(int(n1+n2, 2)) for n1, n2 in zip(nibble_1, nibble_2))
 
 
+def GetSectionLayout(header):
+  """Calculate where the PRG ROM and CHR ROM are from a ROM's iNES header.
+
+  Args:
+    header: The first 16 bytes of the ROM (or more, e.g. the whole ROM).
+
+  Returns:
+    A tuple of the form (prg_start, prg_length, chr_start, chr_length), where
+        the starts are offsets into the ROM file.
+
+  Raises:
+    ValueError: The header is shorter than 16 bytes.
+  """
+  if len(header) < HEADER_LENGTH:
+    raise ValueError(
+        'The iNES header is {} bytes long (expected {}).'.format(
+            len(header), HEADER_LENGTH))
+  prg_length = ConvertToHex(header[4]) * PRG_BANK_SIZE
+  chr_length = ConvertToHex(header[5]) * CHR_BANK_SIZE
+  return (HEADER_LENGTH, prg_length, HEADER_LENGTH + prg_length, chr_length)
+
+
 def GetSpriteSize(sprite):
   """Given a sprite comprised of multiple tiles, calculate the size in pixels.
 
@@ -93,6 +127,8 @@ def GetSpriteSize(sprite):
     A tuple of the form (width, height), where width is the pixel width of the
         combined sprite, and height is the pixel height.
   """
+  if isinstance(sprite, compact_sprites.Metasprite):
+    return sprite.width, sprite.height
   return len(max(sprite, key=len))*8, len(sprite)*8
 
 
@@ -129,6 +165,57 @@ def GetBlockSize(sprite_block):
   return (img_width, img_height)
 
 
+def GetBlockLayout(sprite_block):
+  """Given a sprite block, calculate where each of its sprites is drawn.
+
+  Sprites on a row are placed one after another, and each row of the block
+  starts 32 pixels below the previous one.
+
+  Args:
+    sprite_block: An iterable of iterables, where each inner iterable contains
+        tuples of the form (sprite, palette).
+
+  Returns:
+    A list of tuples of the form (sprite, palette, x_val, y_val), where x_val
+        and y_val are the coordinates at which to draw the sprite.
+  """
+  layout = []
+  last_sprite_height = 0
+  for sprite_row in sprite_block:
+    last_sprite_width = 0
+    for sprite, palette in sprite_row:
+      layout.append((sprite, palette, last_sprite_width, last_sprite_height))
+      last_sprite_width += GetSpriteSize(sprite)[0]
+    last_sprite_height += 32
+
+  return layout
+
+
+def GetSheetCellSize(sprite_count, scale, number_tiles):
+  """Calculate the size of each tile's cell on a sheet of all sprites.
+
+  When numbering tiles, each cell gets a band beneath the tile for its label,
+  and is widened if the label doesn't fit under the tile.
+
+  Args:
+    sprite_count: The number of sprites on the sheet.
+    scale: The factor by which each pixel is enlarged.
+    number_tiles: Whether each tile is labelled with its index.
+
+  Returns:
+    A tuple of the form (width, height, digits), where digits is the number of
+        (hexadecimal) digits in each label.
+  """
+  width = height = 8 * scale
+  if not number_tiles:
+    return width, height, 0
+
+  digits = len('{:x}'.format(max(sprite_count - 1, 0)))
+  width = max(width, bitmap_font.GetLabelWidth(digits))
+  height += bitmap_font.GLYPH_HEIGHT + 1
+  return width, height, digits
+
+
 def MaybeEnlargeImage(img, width, height, x_val, y_val):
   """Enlarge an Image if there is not enough space to write the sprite.
 
@@ -189,21 +276,17 @@ class NESSpriteReader(object):
     self.zero_fill = ConvertToHex(self._file_data[0xA:0xF])
 
     # Start addresses / lengths.
-    header_length = 16
-    self.prg_length = self.prg_banks * 16384
-    self.chr_length = self.chr_banks * 8192
-
-    self.prg_start = header_length
-    self.chr_start = header_length + self.prg_length
+    (self.prg_start, self.prg_length,
+     self.chr_start, self.chr_length) = GetSectionLayout(self._file_data)
 
     self.chr_data = self._file_data[
         self.chr_start:self.chr_start+self.chr_length]
 
     # Read all sprites from chr_data. As described elsewhere, sprites are 16
-    # bytes each, so read in steps of 16.
-    self.sprites = []
-    for index in range(0, self.chr_length, 16):
-      self.LoadSprite(self.chr_data[index:index+16])
+    # bytes each. They are decoded in bulk into a compact TileStore, which
+    # gives the same results as calling LoadSprite on every 16 bytes.
+    self.sprites = compact_sprites.TileStore()
+    self.sprites.ExtendCHR(self.chr_data)
 
     # Load the color palettes.
     self.palettes = {}
@@ -272,7 +355,17 @@ class NESSpriteReader(object):
     print '+{:-^59}+'.format('')
 
   def LoadSprite(self, sprite_data):
-    """Load a specific sprite and store its representation.
+    """Load a specific sprite and store its representation in self.sprites.
+
+    See DecodeSprite for how the sprite is decoded.
+
+    Args:
+      sprite_data: The 16-bytes representing a given sprite.
+    """
+    self.sprites.append(self.DecodeSprite(sprite_data))
+
+  def DecodeSprite(self, sprite_data):
+    """Decode the representation of a specific sprite.
 
     Each sprite is represented by two 8-byte channels (16 total bytes) that are
     overlayed on top of each other to create the final sprite using the
@@ -290,10 +383,11 @@ class NESSpriteReader(object):
       - ca=1, cb=0 -> 2
       - ca=1, cb=1 -> 3
 
-    The resulting sprite will be stored in self.sprites.
-
     Args:
       sprite_data: The 16-bytes representing a given sprite.
+
+    Returns:
+      A list of 8 strings (one per row), each containing 8 values from 0-3.
     """
     channel_a = binascii.hexlify(sprite_data[:8])
     channel_b = binascii.hexlify(sprite_data[8:16])
@@ -324,7 +418,70 @@ class NESSpriteReader(object):
           CompositeSpriteValue(low_a_bin, low_b_bin)
       )
 
-    self.sprites.append(sprite)
+    return sprite
+
+  def ReloadSprites(self, file_data, sprite_indices):
+    """Swap in new ROM data, re-decoding only the given sprites.
+
+    This is used when a ROM is modified on disk (see rom_watcher.py), and
+    assumes that the header (and therefore the layout of the ROM) is unchanged.
+    Palettes are not reloaded; call LoadPalettes to do so.
+
+    Args:
+      file_data: The new contents of the ROM file.
+      sprite_indices: An iterable of the indices of the sprites in chr_data
+          that changed.
+    """
+    self._file_data = file_data
+    self.chr_data = self._file_data[
+        self.chr_start:self.chr_start+self.chr_length]
+
+    for index in sprite_indices:
+      self.sprites[index] = compact_sprites.DecodeCHR(
+          self.chr_data[index*16:index*16+16])
+
+  def FindPRGGraphics(self, threshold=tile_detector.DEFAULT_THRESHOLD,
+                      min_tiles=tile_detector.DEFAULT_MIN_TILES,
+                      max_gap=tile_detector.DEFAULT_MAX_GAP):
+    """Heuristically locate (uncompressed) tile graphics in the PRG ROM.
+
+    This is primarily useful for CHR RAM games (chr_banks == 0), which have no
+    chr_data and therefore no sprites. See tile_detector.py for the details.
+
+    Args:
+      threshold: The minimum score for a 16-byte window to count as tile data.
+      min_tiles: The minimum number of tiles in a region.
+      max_gap: The number of consecutive low-scoring windows that may be
+          bridged within a single region.
+
+    Returns:
+      A list of (start, end) tuples of absolute offsets into the ROM file, which
+          can be passed to LoadSpritesFromRegion.
+    """
+    # Only sliced here (rather than kept around), as nothing else needs it.
+    prg_data = self._file_data[self.prg_start:self.prg_start+self.prg_length]
+    return [
+        (self.prg_start+start, self.prg_start+end)
+        for start, end in tile_detector.FindTileRegions(
+            prg_data, threshold, min_tiles, max_gap)
+    ]
+
+  def LoadSpritesFromRegion(self, start, end):
+    """Load the sprites stored in an arbitrary region of the ROM file.
+
+    The sprites are appended to self.sprites, so they can be drawn just like
+    the sprites from chr_data.
+
+    Args:
+      start: The absolute offset of the first sprite in the ROM file.
+      end: The absolute offset just past the last sprite in the ROM file.
+
+    Returns:
+      The index in self.sprites of the first sprite that was loaded.
+    """
+    first_index = len(self.sprites)
+    self.sprites.ExtendCHR(self._file_data[start:end])
+    return first_index
 
   def LoadPalettes(self, palettes):
     """Load the color palettes for this ROM.
@@ -373,19 +530,31 @@ class NESSpriteReader(object):
     if palette is None:
       palette = DEFAULT_PALETTE.copy()
 
-    for block_row_index, row in enumerate(sprites):
-      for block_col_index, sprite_number in enumerate(row):
-        # This is now a single sprite to write, so pull its data.
-        sprite = self.sprites[sprite_number]
-        for sprite_row_index, sprite_row in enumerate(sprite):
-          for sprite_col_index, value in enumerate(sprite_row):
-            # The coordinate values are the sum of the current index of the
-            # sprite (which will be between 0-7), plus 8x the current position
-            # in the sprite block (to make sure that sprites are properly offset
-            # from each other), plus any initial x/y starting coordinates.
-            x_coord = x_val+sprite_col_index+(block_col_index*8)
-            y_coord = y_val+sprite_row_index+(block_row_index*8)
-            img.putpixel((x_coord, y_coord), palette[value])
+    # Find the (row, column) in the sprite block of each tile. A Metasprite
+    # already has its tiles in a flat array, with short rows padded.
+    if isinstance(sprites, compact_sprites.Metasprite):
+      placements = (
+          divmod(position, sprites.columns) + (sprite_number,)
+          for position, sprite_number in enumerate(sprites.tiles)
+          if sprite_number != compact_sprites.NO_TILE)
+    else:
+      placements = (
+          (block_row_index, block_col_index, sprite_number)
+          for block_row_index, row in enumerate(sprites)
+          for block_col_index, sprite_number in enumerate(row))
+
+    for block_row_index, block_col_index, sprite_number in placements:
+      # This is now a single sprite to write, so pull its data.
+      sprite = self.sprites[sprite_number]
+      for sprite_row_index, sprite_row in enumerate(sprite):
+        for sprite_col_index, value in enumerate(sprite_row):
+          # The coordinate values are the sum of the current index of the
+          # sprite (which will be between 0-7), plus 8x the current position
+          # in the sprite block (to make sure that sprites are properly offset
+          # from each other), plus any initial x/y starting coordinates.
+          x_coord = x_val+sprite_col_index+(block_col_index*8)
+          y_coord = y_val+sprite_row_index+(block_row_index*8)
+          img.putpixel((x_coord, y_coord), palette[value])
 
     return img
 
@@ -412,28 +581,20 @@ class NESSpriteReader(object):
     if img is None:
       img = Image.new('RGB', (img_width, img_height), 'white')
 
-    last_sprite_width = 0
-    last_sprite_height = 0
-    for row_idx, sprite_row in enumerate(sprite_block):
-      for sprite_idx, (sprite, palette) in enumerate(sprite_row):
-        img = self.DrawSprite(
-            img, sprite, palette,
-            x_val=last_sprite_width,
-            y_val=last_sprite_height,
-        )
-        last_sprite_width += (len(max(sprite, key=len))*8)
-      last_sprite_height += 32
-      last_sprite_width = 0
+    for sprite, palette, x_val, y_val in GetBlockLayout(sprite_block):
+      img = self.DrawSprite(img, sprite, palette, x_val=x_val, y_val=y_val)
 
     return img
 
   def WriteAndNumberAllSprites(
-      self, file_name='all_sprites.bmp', palette=None, per_row=10):
-    """Output the entire set of sprites in rows of 10, numbering each row.
+      self, file_name='all_sprites.bmp', palette=None, per_row=10,
+      number_tiles=False):
+    """Output the entire set of sprites in rows, numbering each row or tile.
 
     The primary use for this is to generate an image containing all of the
     sprites with garish numbers at the beginning of each row that represent the
-    index of the first sprite in the sprite array.
+    index of the first sprite in the sprite array (or, with number_tiles, the
+    index of every tile beneath it).
 
     Args:
       file_name: The name of the output file.
@@ -442,28 +603,27 @@ class NESSpriteReader(object):
           containing the integer RGB values for each key. If no palette is
           provided, a simple grey will be used.
       per_row: The number of sprite tiles to print on each row (default: 10).
+      number_tiles: If True, label every tile with its (hexadecimal) index
+          using bitmap_font, instead of numbering the beginning of each row.
     """
-    height = ((len(self.sprites) / per_row) + 1) * 8
+    cell_width, cell_height, digits = GetSheetCellSize(
+        len(self.sprites), 1, number_tiles)
+    height = ((len(self.sprites) / per_row) + 1) * cell_height
 
-    img = Image.new('RGB', (8*per_row, height), 'white')
+    img = Image.new('RGB', (cell_width*per_row, height), 'white')
     draw = ImageDraw.Draw(img)
-    # TODO: We need a bitmapped font so that it is legible. Since the sprite
-    # tiles are small, most fonts are completely illegible. For now, we write
-    # the tile number at the beginning of each row - less convenient but more
-    # portable (for now).
-    # font = ImageFont.truetype(
-    #     '/usr/share/fonts/truetype/ttf-dejavu/DejaVuSans-ExtraLight.ttf',
-    #     size=4,
-    # )
+    # Regular fonts are illegible at the size of a tile, so without
+    # number_tiles we write the tile number at the beginning of each row.
     font = ImageFont.load_default()
+    atlas = bitmap_font.GetAtlas()
 
     if palette is None:
       palette = DEFAULT_PALETTE.copy()
 
     for row_index in xrange(0, len(self.sprites), per_row):
-      # Tiles are 8 pixels tall, so this calculates the proper y-offset
-      # regardless of the per_row number chosen.
-      y_offset = (row_index/per_row) * 8
+      # This calculates the proper y-offset regardless of the per_row number
+      # chosen.
+      y_offset = (row_index/per_row) * cell_height
 
       # On each row, print as many sprites as specified in per_row.
       for col_index in xrange(per_row):
@@ -475,14 +635,113 @@ class NESSpriteReader(object):
           # The syntax for referencing the sprite to draw is ugly.
           self.DrawSprite(
               img, [[row_index+col_index]], palette,
-              x_val=col_index*8,
+              x_val=col_index*cell_width,
               y_val=y_offset,
           )
         except IndexError:
           break
-      # Write the number of the first tile in the row. Write after the tiles are
-      # drawn so that the text doesn't get covered by the tile. Use a garish
-      # green for no good reason other than it is green.
-      draw.text((0, y_offset), str(row_index), (0, 255, 0), font=font)
+
+      if number_tiles:
+        # Label each tile in the band beneath it, the whole row at once.
+        atlas.DrawLabels(
+            img,
+            ['{:0{digits}x}'.format(index, digits=digits)
+             for index in xrange(
+                 row_index, min(row_index+per_row, len(self.sprites)))],
+            LABEL_COLOR, 0, y_offset+8, cell_width)
+      else:
+        # Write the number of the first tile in the row. Write after the tiles
+        # are drawn so that the text doesn't get covered by the tile.
+        draw.text((0, y_offset), str(row_index), LABEL_COLOR, font=font)
 
     img.save(file_name)
+
+  def StreamAllSprites(
+      self, file_name='all_sprites.png', palette=None, per_row=10, scale=1,
+      strip_rows=16, number_tiles=False):
+    """Write the entire set of sprites to an indexed PNG, strip by strip.
+
+    Unlike WriteAndNumberAllSprites, the sheet is never held in memory as a
+    whole: strip_rows rows of tiles are rendered at a time and handed to
+    png_writer, so memory use depends on the strip height rather than on the
+    number of sprites (or the scale).
+
+    Args:
+      file_name: The name of the output file.
+      palette: A dictionary of the form {'num': (R, G, B)} (see
+          WriteAndNumberAllSprites). If no palette is provided, a simple grey
+          will be used.
+      per_row: The number of sprite tiles to write on each row (default: 10).
+      scale: An integer factor by which to enlarge each pixel (nearest
+          neighbour).
+      strip_rows: The number of rows of tiles to render at a time.
+      number_tiles: If True, label every tile with its (hexadecimal) index
+          using bitmap_font.
+
+    Raises:
+      ValueError: There are no sprites to write (a PNG can't be 0 pixels high).
+    """
+    if not len(self.sprites):
+      raise ValueError('There are no sprites to write.')
+
+    if palette is None:
+      palette = DEFAULT_PALETTE.copy()
+
+    # Indices 0-3 are the tile colors; the indices after them are used for the
+    # background (white, like WriteAndNumberAllSprites) and the labels.
+    colors = [palette[value] for value in '0123'] + [
+        (0xff, 0xff, 0xff), LABEL_COLOR]
+    blank_index = 4
+    label_index = 5
+
+    cell_width, cell_height, digits = GetSheetCellSize(
+        len(self.sprites), scale, number_tiles)
+    tile_rows = int(math.ceil(len(self.sprites) / float(per_row)))
+    width = per_row * cell_width
+    height = tile_rows * cell_height
+
+    # Each 8-pixel row of a tile is a string of '0'-'3'; convert those to
+    # (scaled) palette indices, padded to the width of a cell, remembering the
+    # result as rows repeat a lot.
+    scaled_rows = {}
+    blank_cell = chr(blank_index) * cell_width
+    cell_padding = chr(blank_index) * (cell_width - 8*scale)
+    atlas = bitmap_font.GetAtlas()
+
+    def ScaleRow(sprite_row):
+      scaled = scaled_rows.get(sprite_row)
+      if scaled is None:
+        scaled = ''.join(
+            chr(int(value))*scale for value in sprite_row) + cell_padding
+        scaled_rows[sprite_row] = scaled
+      return scaled
+
+    with png_writer.IndexedPNGWriter(file_name, width, height, colors) as png:
+      for strip_start in xrange(0, tile_rows, strip_rows):
+        strip = []
+        for row_index in xrange(
+            strip_start, min(strip_start + strip_rows, tile_rows)):
+          first_sprite = row_index * per_row
+          sprites = self.sprites[first_sprite:first_sprite+per_row]
+          padding = blank_cell * (per_row - len(sprites))
+          for line in xrange(8):
+            scanline = ''.join(
+                ScaleRow(sprite[line]) for sprite in sprites) + padding
+            strip.extend([scanline] * scale)
+
+          if number_tiles:
+            # Label each tile in the band beneath it, one row of glyphs at a
+            # time.
+            label_padding = chr(blank_index) * (
+                cell_width - bitmap_font.GetLabelWidth(digits))
+            labels = zip(*[
+                atlas.GetLabelRows(
+                    '{:0{digits}x}'.format(index, digits=digits),
+                    label_index, blank_index)
+                for index in xrange(first_sprite, first_sprite+len(sprites))
+            ])
+            for label_line in labels:
+              strip.append(
+                  label_padding.join(label_line) + label_padding + padding)
+            strip.append(chr(blank_index) * width)
+        png.WriteRows(strip)
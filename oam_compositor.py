@@ -0,0 +1,315 @@
+"""NES Sprite Reader - Composite full frames from OAM dumps.
+
+The PPU keeps the attributes of all 64 hardware sprites in OAM (Object
+Attribute Memory), a 256-byte table with one 4-byte entry per sprite [1]:
+
+    Byte 0: Y position of the top of the sprite (minus one).
+    Byte 1: Tile index. In 8x16 mode, bit 0 selects the pattern table and the
+        remaining bits select the top tile of the pair.
+    Byte 2: Attributes.
+        76543210
+        ||||||++- Palette (4 to 7) of the sprite.
+        |||+++--- Unimplemented.
+        ||+------ Priority (0: in front of background, 1: behind background).
+        |+------- Flip sprite horizontally.
+        +-------- Flip sprite vertically.
+    Byte 3: X position of the left side of the sprite.
+
+Rather than hand-assembling sprites (as in roms/smb3/smb3_sprites.py), an OAM
+dump captured from an emulator can be fed to the OAMCompositor, which will lay
+out all 64 sprites exactly as the PPU would: color 0 is transparent, sprites
+earlier in OAM are drawn on top of later ones, and the priority bit of the
+front-most sprite decides whether the background covers it.
+
+Every tile is only ever decoded into an Image once per (palette, flip)
+combination, so compositing a long recording of OAM dumps mostly consists of
+pasting cached tiles.
+
+Resources:
+  [1] http://wiki.nesdev.com/w/index.php/PPU_OAM
+"""
+
+from PIL import Image
+from PIL import ImageChops
+
+
+OAM_SIZE = 256
+OAM_ENTRY_SIZE = 4
+
+SCREEN_WIDTH = 256
+SCREEN_HEIGHT = 240
+
+# Sprites whose Y coordinate is at or beyond this value are off screen (games
+# typically 'hide' unused sprites by moving them to Y=0xEF-0xFF).
+HIDDEN_Y = 0xef
+
+ATTR_PALETTE = 0x03
+ATTR_PRIORITY = 0x20
+ATTR_FLIP_H = 0x40
+ATTR_FLIP_V = 0x80
+
+# Number of tiles in a single pattern table (4K / 16 bytes).
+PATTERN_TABLE_TILES = 256
+
+
+def ParseOAM(oam_data):
+  """Parse a 256-byte OAM dump into its sprite entries.
+
+  Args:
+    oam_data: A 256-byte string containing the OAM table.
+
+  Returns:
+    A list of 64 tuples of the form (y, tile, attributes, x), in OAM order.
+
+  Raises:
+    ValueError: The OAM dump is not 256 bytes long.
+  """
+  if len(oam_data) != OAM_SIZE:
+    raise ValueError(
+        'OAM dumps must be {} bytes (got {}).'.format(OAM_SIZE, len(oam_data)))
+
+  values = bytearray(oam_data)
+  return [
+      tuple(values[index:index+OAM_ENTRY_SIZE])
+      for index in xrange(0, OAM_SIZE, OAM_ENTRY_SIZE)
+  ]
+
+
+def ReadOAMStream(file_path):
+  """Read a recorded stream of OAM dumps, one frame at a time.
+
+  The file is expected to be a simple concatenation of 256-byte OAM dumps (one
+  per frame), which is what most emulator memory-dumping scripts produce.
+
+  Args:
+    file_path: The path to the recorded OAM stream.
+
+  Yields:
+    256-byte strings, each containing a single frame's OAM table.
+  """
+  with open(file_path, 'rb') as f:
+    while True:
+      oam_data = f.read(OAM_SIZE)
+      if len(oam_data) < OAM_SIZE:
+        break
+      yield oam_data
+
+
+class OAMCompositor(object):
+  """Composite NES frames from OAM dumps.
+
+  Args:
+    reader: The NESSpriteReader whose sprites the OAM tile indices refer to.
+    sprite_palettes: An iterable of the four sprite palettes (each a dictionary
+        of the form {'num': (R, G, B)}, such as the values in
+        NESSpriteReader.palettes), indexed by the palette bits of each sprite's
+        attributes.
+    tall_sprites: If True, sprites are 8x16 (PPUCTRL bit 5 set). Otherwise,
+        sprites are 8x8.
+    pattern_table: The pattern table (0 or 1) used for 8x8 sprites (PPUCTRL bit
+        3). Ignored for 8x16 sprites, which encode it in their tile index.
+    chr_offset: The index into reader.sprites of the first tile of the CHR
+        bank currently mapped to the PPU (default: 0).
+  """
+
+  def __init__(self, reader, sprite_palettes, tall_sprites=False,
+               pattern_table=0, chr_offset=0):
+    self.reader = reader
+    self.sprite_palettes = list(sprite_palettes)
+    self.tall_sprites = tall_sprites
+    self.pattern_table = pattern_table
+    self.chr_offset = chr_offset
+
+    if len(self.sprite_palettes) != 4:
+      raise ValueError(
+          'Expected 4 sprite palettes (got {}).'.format(
+              len(self.sprite_palettes)))
+
+    # Caches of tile masks (keyed on (tile, flip_h, flip_v)) and colored tiles
+    # (keyed on (tile, palette, flip_h, flip_v)).
+    self._mask_cache = {}
+    self._tile_cache = {}
+
+  def _GetTileMask(self, tile_index, flip_h, flip_v):
+    """Return the (cached) opacity mask of a tile.
+
+    Args:
+      tile_index: The index of the tile in self.reader.sprites.
+      flip_h: Whether the tile is flipped horizontally.
+      flip_v: Whether the tile is flipped vertically.
+
+    Returns:
+      An 8x8 'L' Image that is 255 wherever the tile is opaque (non-zero).
+    """
+    key = (tile_index, flip_h, flip_v)
+    mask = self._mask_cache.get(key)
+    if mask is None:
+      if flip_h or flip_v:
+        mask = _FlipImage(self._GetTileMask(tile_index, False, False),
+                          flip_h, flip_v)
+      else:
+        mask = Image.new('L', (8, 8))
+        mask.putdata([
+            0 if value == '0' else 255
+            for row in self.reader.sprites[tile_index]
+            for value in row
+        ])
+      self._mask_cache[key] = mask
+    return mask
+
+  def _GetTile(self, tile_index, palette_index, flip_h, flip_v):
+    """Return the (cached) colored Image of a tile.
+
+    Args:
+      tile_index: The index of the tile in self.reader.sprites.
+      palette_index: The sprite palette (0-3) with which to color the tile.
+      flip_h: Whether the tile is flipped horizontally.
+      flip_v: Whether the tile is flipped vertically.
+
+    Returns:
+      An 8x8 'RGB' Image of the tile.
+    """
+    key = (tile_index, palette_index, flip_h, flip_v)
+    tile = self._tile_cache.get(key)
+    if tile is None:
+      if flip_h or flip_v:
+        tile = _FlipImage(
+            self._GetTile(tile_index, palette_index, False, False),
+            flip_h, flip_v)
+      else:
+        palette = self.sprite_palettes[palette_index]
+        tile = Image.new('RGB', (8, 8))
+        tile.putdata([
+            palette[value]
+            for row in self.reader.sprites[tile_index]
+            for value in row
+        ])
+      self._tile_cache[key] = tile
+    return tile
+
+  def _GetSpriteTiles(self, tile, flip_v):
+    """Determine which tiles make up a sprite, from top to bottom.
+
+    Args:
+      tile: The tile byte of the OAM entry.
+      flip_v: Whether the sprite is flipped vertically. For 8x16 sprites, this
+          swaps the top and bottom tiles.
+
+    Returns:
+      A list of tile indices into self.reader.sprites.
+    """
+    if not self.tall_sprites:
+      return [self.chr_offset + self.pattern_table*PATTERN_TABLE_TILES + tile]
+
+    top = self.chr_offset + (tile & 1)*PATTERN_TABLE_TILES + (tile & 0xfe)
+    if flip_v:
+      return [top+1, top]
+    return [top, top+1]
+
+  def CompositeSprites(self, oam_data):
+    """Composite the sprite layer of a single frame.
+
+    Sprites are pasted from the back of OAM to the front, so that sprites with
+    a lower OAM index end up on top.
+
+    Args:
+      oam_data: A 256-byte string containing the OAM table.
+
+    Returns:
+      A tuple of the form (sprites, coverage, behind), where sprites is an
+          'RGB' Image of the sprite layer, coverage is an 'L' Image that is 255
+          wherever a sprite pixel is opaque, and behind is an 'L' Image that is
+          255 wherever the front-most sprite pixel has background priority.
+    """
+    size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    sprites = Image.new('RGB', size)
+    coverage = Image.new('L', size)
+    behind = Image.new('L', size)
+
+    for y, tile, attributes, x in reversed(ParseOAM(oam_data)):
+      if y >= HIDDEN_Y:
+        continue
+
+      palette_index = attributes & ATTR_PALETTE
+      flip_h = bool(attributes & ATTR_FLIP_H)
+      flip_v = bool(attributes & ATTR_FLIP_V)
+      priority = 255 if attributes & ATTR_PRIORITY else 0
+
+      # Sprite data is delayed by one scanline.
+      y_offset = y + 1
+      for tile_index in self._GetSpriteTiles(tile, flip_v):
+        mask = self._GetTileMask(tile_index, flip_h, flip_v)
+        box = (x, y_offset)
+        sprites.paste(
+            self._GetTile(tile_index, palette_index, flip_h, flip_v), box, mask)
+        coverage.paste(255, box + (x+8, y_offset+8), mask)
+        behind.paste(priority, box + (x+8, y_offset+8), mask)
+        y_offset += 8
+
+    return sprites, coverage, behind
+
+  def CompositeFrame(self, oam_data, background=None, background_mask=None):
+    """Composite a full frame from an OAM dump.
+
+    Args:
+      oam_data: A 256-byte string containing the OAM table.
+      background: An optional 256x240 Image containing the background layer.
+          If no background is provided, the frame is filled with color 0 of
+          the first sprite palette (the universal background color).
+      background_mask: An optional 256x240 'L' (or '1') Image that is non-zero
+          wherever the background is opaque. Sprites with background priority
+          are hidden behind these pixels. If no mask is provided, the
+          background is treated as fully transparent.
+
+    Returns:
+      A 256x240 'RGB' Image of the composited frame.
+    """
+    if background is None:
+      frame = Image.new(
+          'RGB', (SCREEN_WIDTH, SCREEN_HEIGHT), self.sprite_palettes[0]['0'])
+    else:
+      frame = background.convert('RGB')
+
+    sprites, coverage, behind = self.CompositeSprites(oam_data)
+
+    if background_mask is not None:
+      # Hide sprite pixels where the front-most sprite is behind the background
+      # and the background is opaque.
+      hidden = ImageChops.multiply(
+          behind, background_mask.convert('L').point(lambda v: v and 255))
+      coverage = ImageChops.subtract(coverage, hidden)
+
+    frame.paste(sprites, (0, 0), coverage)
+    return frame
+
+  def CompositeStream(self, oam_stream, background=None, background_mask=None):
+    """Composite a frame for every OAM dump in a stream.
+
+    Args:
+      oam_stream: An iterable of 256-byte OAM dumps (see ReadOAMStream).
+      background: An optional background Image (see CompositeFrame).
+      background_mask: An optional background mask (see CompositeFrame).
+
+    Yields:
+      A composited 'RGB' Image for each frame.
+    """
+    for oam_data in oam_stream:
+      yield self.CompositeFrame(oam_data, background, background_mask)
+
+
+def _FlipImage(img, flip_h, flip_v):
+  """Return a flipped copy of an Image.
+
+  Args:
+    img: The Image to flip.
+    flip_h: Whether to flip the Image horizontally.
+    flip_v: Whether to flip the Image vertically.
+
+  Returns:
+    The flipped Image.
+  """
+  if flip_h:
+    img = img.transpose(Image.FLIP_LEFT_RIGHT)
+  if flip_v:
+    img = img.transpose(Image.FLIP_TOP_BOTTOM)
+  return img
@@ -0,0 +1,141 @@
+"""NES Sprite Reader - Incremental indexed PNG writer.
+
+PIL needs the entire image in memory before it can be saved, which gets
+expensive for sprite sheets of large CHR ROMs (especially when scaled up). NES
+tiles only ever use a handful of colors, so they map naturally to an indexed
+(palette-based) PNG [1], which can be written one scanline at a time:
+
+  * The header (IHDR) and palette (PLTE) chunks are written up front.
+  * Each scanline (a filter byte followed by one palette index per pixel) is
+    fed through a zlib compressor, and the compressed output is flushed to the
+    file in IDAT chunks as it accumulates.
+  * The IEND chunk is written when the image is closed.
+
+Memory use therefore only depends on how many scanlines the caller renders at
+a time, not on the size of the image.
+
+Resources:
+  [1] http://www.libpng.org/pub/png/spec/1.2/PNG-Chunks.html
+"""
+
+import struct
+import zlib
+
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Bit depth and color type of an 8-bit indexed PNG.
+BIT_DEPTH = 8
+COLOR_TYPE_INDEXED = 3
+
+# Scanlines are written without filtering.
+FILTER_NONE = '\x00'
+
+# Write an IDAT chunk once this much compressed data has accumulated.
+IDAT_CHUNK_SIZE = 1 << 16
+
+
+def _WriteChunk(f, chunk_type, data):
+  """Write a single PNG chunk.
+
+  Args:
+    f: The file object to write to.
+    chunk_type: The 4-character chunk type (e.g. 'IDAT').
+    data: The chunk data.
+  """
+  f.write(struct.pack('>I', len(data)))
+  f.write(chunk_type)
+  f.write(data)
+  f.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+class IndexedPNGWriter(object):
+  """Write an 8-bit indexed PNG one scanline at a time.
+
+  Args:
+    file_name: The name of the output file.
+    width: The width of the image in pixels.
+    height: The height of the image in pixels.
+    colors: A list of (R, G, B) tuples; pixel values are indices into it.
+  """
+
+  def __init__(self, file_name, width, height, colors):
+    self.width = width
+    self.height = height
+    self.rows_written = 0
+
+    self._file = open(file_name, 'wb')
+    self._compressor = zlib.compressobj()
+    self._pending = []
+    self._pending_size = 0
+
+    self._file.write(PNG_SIGNATURE)
+    _WriteChunk(self._file, 'IHDR', struct.pack(
+        '>IIBBBBB', width, height, BIT_DEPTH, COLOR_TYPE_INDEXED, 0, 0, 0))
+    _WriteChunk(self._file, 'PLTE', ''.join(
+        struct.pack('BBB', *color) for color in colors))
+
+  def _Queue(self, data):
+    """Queue compressed data, writing an IDAT chunk once enough is pending.
+
+    Args:
+      data: Compressed image data.
+    """
+    if not data:
+      return
+    self._pending.append(data)
+    self._pending_size += len(data)
+    if self._pending_size >= IDAT_CHUNK_SIZE:
+      self._FlushPending()
+
+  def _FlushPending(self):
+    """Write all pending compressed data as a single IDAT chunk."""
+    if self._pending:
+      _WriteChunk(self._file, 'IDAT', ''.join(self._pending))
+      self._pending = []
+      self._pending_size = 0
+
+  def WriteRows(self, rows):
+    """Write scanlines to the image.
+
+    Args:
+      rows: An iterable of byte strings, each containing one palette index per
+          pixel (and exactly self.width bytes long).
+
+    Raises:
+      ValueError: A row is the wrong length, or too many rows were written.
+    """
+    for row in rows:
+      if len(row) != self.width:
+        raise ValueError(
+            'Expected a row of {} pixels (got {}).'.format(
+                self.width, len(row)))
+      if self.rows_written >= self.height:
+        raise ValueError('Image already has {} rows.'.format(self.height))
+      self._Queue(self._compressor.compress(FILTER_NONE + row))
+      self.rows_written += 1
+
+  def Close(self):
+    """Finish the image and close the file.
+
+    Raises:
+      ValueError: Fewer rows were written than the height of the image.
+    """
+    try:
+      if self.rows_written != self.height:
+        raise ValueError(
+            'Expected {} rows (got {}).'.format(self.height, self.rows_written))
+      self._Queue(self._compressor.flush())
+      self._FlushPending()
+      _WriteChunk(self._file, 'IEND', '')
+    finally:
+      self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.Close()
+    else:
+      self._file.close()
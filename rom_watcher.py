@@ -0,0 +1,164 @@
+"""NES Sprite Reader - Re-render sprites as a ROM is edited.
+
+When working on a ROM's graphics, the ROM is saved over and over again, and
+usually only a couple of tiles change each time. Rather than constructing a new
+NESSpriteReader (decoding every tile) and re-rendering everything, the
+RomWatcher:
+
+  1. Polls the ROM's modification time and size.
+  2. On a change, finds the tiles whose 16 bytes changed (see chr_diff.py) and
+     re-decodes just those tiles in place.
+  3. Looks up the outputs that use those tiles (or any palette whose bytes
+     changed) in a reverse tile -> output index, and re-renders only those.
+
+If the header changes (e.g. the number of banks), everything is reloaded. A ROM
+that is shorter than its header says (e.g. because it is still being saved) is
+ignored until the next check.
+"""
+
+import collections
+import os
+import time
+
+import chr_diff
+import nes_sprite_reader
+
+
+def GetExpectedSize(header):
+  """Calculate the minimum size of a ROM from its header.
+
+  Args:
+    header: The first 16 bytes of the ROM.
+
+  Returns:
+    The size in bytes of the header, PRG ROM and CHR ROM, or None if the header
+        is incomplete.
+  """
+  try:
+    _, _, chr_start, chr_length = nes_sprite_reader.GetSectionLayout(header)
+  except ValueError:
+    return None
+  return chr_start + chr_length
+
+
+class RomWatcher(object):
+  """Watch a ROM and re-render the outputs affected by each change.
+
+  Args:
+    file_path: The path to the .nes ROM to watch.
+    palettes: The palette table for the ROM (see smb3/smb3_palettes.py).
+    targets: A dictionary of the form {output_path: sprite_block}, where each
+        sprite_block is like the ones passed to DrawSpriteBlock, except that
+        palettes are given by name (e.g. 'regular_mario_palette').
+  """
+
+  def __init__(self, file_path, palettes, targets):
+    self.file_path = file_path
+    self.palettes = palettes
+    self.targets = targets
+
+    # Reverse indices from tiles and palette names to the outputs using them.
+    self.tile_index = collections.defaultdict(set)
+    self.palette_index = collections.defaultdict(set)
+    for output, sprite_block in targets.iteritems():
+      for sprite_row in sprite_block:
+        for sprite, palette_name in sprite_row:
+          self.palette_index[palette_name].add(output)
+          for row in sprite:
+            for tile in row:
+              self.tile_index[tile].add(output)
+
+    self._stat = self._Stat()
+    self._Load()
+
+  def _Load(self):
+    """(Re)load the ROM from scratch."""
+    self.reader = nes_sprite_reader.NESSpriteReader(
+        self.file_path, self.palettes)
+    with open(self.file_path, 'rb') as f:
+      self._header = f.read(nes_sprite_reader.HEADER_LENGTH)
+
+  def _Stat(self):
+    """Return the (modification time, size) of the ROM."""
+    stat = os.stat(self.file_path)
+    return stat.st_mtime, stat.st_size
+
+  def Render(self, outputs):
+    """Render the given outputs.
+
+    Args:
+      outputs: An iterable of output paths (keys of self.targets).
+    """
+    for output in outputs:
+      sprite_block = [
+          [(sprite, self.reader.palettes[palette_name])
+           for sprite, palette_name in sprite_row]
+          for sprite_row in self.targets[output]
+      ]
+      self.reader.DrawSpriteBlock(
+          img=None, sprite_block=sprite_block).save(output)
+
+  def RenderAll(self):
+    """Render every output."""
+    self.Render(self.targets)
+
+  def Check(self):
+    """Check the ROM for modifications, re-rendering the affected outputs.
+
+    Returns:
+      A sorted list of the outputs that were re-rendered.
+    """
+    stat = self._Stat()
+    if stat == self._stat:
+      return []
+
+    with open(self.file_path, 'rb') as f:
+      file_data = f.read()
+
+    # The ROM may be partway through being saved. Leave self._stat alone so
+    # that the ROM is read again on the next check.
+    header = file_data[:nes_sprite_reader.HEADER_LENGTH]
+    expected_size = GetExpectedSize(header)
+    if expected_size is None or len(file_data) < expected_size:
+      return []
+    self._stat = stat
+
+    if header != self._header:
+      # The layout of the ROM may have changed, so start from scratch.
+      self._Load()
+      self.RenderAll()
+      return sorted(self.targets)
+
+    reader = self.reader
+    new_chr = file_data[reader.chr_start:reader.chr_start+reader.chr_length]
+    changed_tiles = [
+        tile for tile, _ in chr_diff.DiffCHR(reader.chr_data, new_chr)]
+    old_palettes = dict(reader.palettes)
+
+    reader.ReloadSprites(file_data, changed_tiles)
+    reader.LoadPalettes(self.palettes)
+
+    outputs = set()
+    for tile in changed_tiles:
+      outputs.update(self.tile_index.get(tile, ()))
+    for palette_name, palette in reader.palettes.iteritems():
+      if old_palettes.get(palette_name) != palette:
+        outputs.update(self.palette_index.get(palette_name, ()))
+
+    self.Render(outputs)
+    return sorted(outputs)
+
+  def Watch(self, interval=0.5, callback=None):
+    """Render every output, then re-render as the ROM changes (forever).
+
+    Args:
+      interval: The number of seconds between checks of the ROM.
+      callback: An optional function called with the list of re-rendered
+          outputs after every change.
+    """
+    self.RenderAll()
+    while True:
+      outputs = self.Check()
+      if outputs and callback is not None:
+        callback(outputs)
+      time.sleep(interval)
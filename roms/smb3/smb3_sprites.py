@@ -21,9 +21,14 @@ There are definitely much better ways to do this (such as using an emulator and
 tracking down exactly which sprites are use in which situations), but as this
 is more of an experiment, this (very, very) manual approach is used. In any
 case, many of these follow certain patterns, so this could likely be automated
-as well.
+as well (sprite_assembler.py makes a start at proposing these automatically).
+
+Each definition is converted into a compact_sprites.Metasprite at the bottom of
+this module, so that its size is only measured once.
 """
 
+import compact_sprites
+
 # Border for a 4-tile height sprite (in some cases, a sprite ends just at the
 # border of a tile, so this adds a little padding if needed).
 BORDER = (
@@ -182,3 +187,7 @@ MUSIC_BOX = (
   (312, 314),
   (313, 315),
 )
+
+
+# Convert all of the definitions above into Metasprites.
+compact_sprites.ConvertDefinitions(globals())
@@ -0,0 +1,210 @@
+"""NES Sprite Reader - Share decoded sprites between processes.
+
+Every NESSpriteReader decodes all of its ROM's sprites when it is constructed,
+so a pool of worker processes that each construct their own reader decodes
+(and holds) the same sprites many times over. Instead, one process can decode
+the ROM once into a SharedSpriteStore, and each worker attaches a read-only
+SharedSpriteReader to it by name.
+
+The store is a named, memory-mapped file (in /dev/shm where available, so it
+never touches the disk) laid out as:
+
+    +-------+-------------+----------+----------+-------------------------+
+    | MAGIC | meta length | metadata | chr_data | decoded sprites         |
+    +-------+-------------+----------+----------+-------------------------+
+
+The metadata is JSON (sprite count, palettes and the owner's PID). The decoded
+sprites are laid out exactly as in a TileStore (see compact_sprites.py), so the
+workers' sprites are simply a TileStore over the map.
+
+Workers only ever map the store read-only, so a crashing worker cannot damage
+it and leaves nothing to clean up. The store is removed by its owner when it is
+closed (it is a context manager) or when the owner exits. Stores left behind by
+an owner that was killed outright are removed by RemoveStaleStores, which runs
+whenever a new store is created. A store's name records its owner's PID and
+start time, so a new process that happens to reuse the PID doesn't keep the
+store alive.
+"""
+
+import atexit
+import errno
+import json
+import mmap
+import os
+import struct
+import tempfile
+import uuid
+
+import compact_sprites
+import nes_sprite_reader
+
+
+MAGIC = 'NESSPR01'
+PREFIX = 'nes_sprites_'
+
+_HEADER = struct.Struct('>8sI')
+
+
+def _GetSharedDirectory():
+  """Return the directory in which stores are created."""
+  if os.path.isdir('/dev/shm'):
+    return '/dev/shm'
+  return tempfile.gettempdir()
+
+
+def _GetPath(name):
+  """Return the path of the store with the given name."""
+  return os.path.join(_GetSharedDirectory(), name)
+
+
+def _GetStartTime(pid):
+  """Return the start time of a process (in clock ticks since boot).
+
+  Returns:
+    The start time, or 0 if it can't be determined (e.g. there is no /proc).
+  """
+  try:
+    with open('/proc/{}/stat'.format(pid)) as f:
+      stat = f.read()
+  except IOError:
+    return 0
+  # The command name (field 2) may contain spaces, so count fields from the
+  # closing parenthesis after it; the start time is field 22.
+  return int(stat.rpartition(')')[2].split()[19])
+
+
+def _IsAlive(pid, start_time):
+  """Determine whether a process is still running.
+
+  Args:
+    pid: The PID of the process.
+    start_time: The start time of the process (see _GetStartTime), which
+        tells it apart from a later process with the same PID. If 0, only the
+        PID is checked.
+  """
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    if e.errno != errno.EPERM:
+      return False
+  return not start_time or _GetStartTime(pid) in (0, start_time)
+
+
+class SharedSpriteStore(object):
+  """Decoded sprites of a NESSpriteReader, in a named shared memory block.
+
+  Args:
+    reader: The NESSpriteReader whose sprites (and palettes) to share.
+  """
+
+  def __init__(self, reader):
+    RemoveStaleStores()
+
+    pid = os.getpid()
+    self.name = '{}{}_{}_{}'.format(
+        PREFIX, pid, _GetStartTime(pid), uuid.uuid4().hex)
+    self.path = _GetPath(self.name)
+
+    metadata = json.dumps({
+        'pid': pid,
+        'sprite_count': len(reader.sprites),
+        'chr_length': len(reader.chr_data),
+        'palettes': reader.palettes,
+    })
+
+    # Only the creating process removes the store.
+    self._owner_pid = pid
+    atexit.register(self.Close)
+
+    with open(self.path, 'wb') as f:
+      f.write(_HEADER.pack(MAGIC, len(metadata)))
+      f.write(metadata)
+      f.write(reader.chr_data)
+      if isinstance(reader.sprites, compact_sprites.TileStore):
+        f.write(reader.sprites.ToString())
+      else:
+        for sprite in reader.sprites:
+          f.write(''.join(sprite))
+
+  def Close(self):
+    """Remove the store (existing mappings stay valid until unmapped)."""
+    if os.getpid() != self._owner_pid:
+      return
+    try:
+      os.unlink(self.path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.Close()
+
+
+class SharedSpriteReader(nes_sprite_reader.NESSpriteReader):
+  """A read-only NESSpriteReader attached to a SharedSpriteStore.
+
+  Only the sprites, chr_data and palettes are available, which is enough for
+  all of the drawing methods.
+
+  Args:
+    name: The name of the SharedSpriteStore.
+  """
+
+  def __init__(self, name):
+    with open(_GetPath(name), 'rb') as f:
+      self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, metadata_length = _HEADER.unpack(self._data[:_HEADER.size])
+    if magic != MAGIC:
+      raise ValueError('{} is not a shared sprite store.'.format(name))
+
+    offset = _HEADER.size
+    metadata = json.loads(self._data[offset:offset+metadata_length])
+    offset += metadata_length
+
+    # A buffer, so that the CHR data isn't copied into every process.
+    self.chr_length = metadata['chr_length']
+    self.chr_data = buffer(self._data, offset, self.chr_length)
+    offset += self.chr_length
+
+    # The mmap is read-only, so so is the TileStore.
+    self.sprites = compact_sprites.TileStore(
+        self._data, offset, metadata['sprite_count'])
+    self.palettes = {
+        str(palette_name): {
+            str(value): tuple(color) for value, color in palette.iteritems()
+        }
+        for palette_name, palette in metadata['palettes'].iteritems()
+    }
+
+  def Close(self):
+    """Unmap the store."""
+    self._data.close()
+
+
+def RemoveStaleStores():
+  """Remove stores whose owning process (PID and start time) no longer exists.
+
+  Returns:
+    A list of the names of the removed stores.
+  """
+  removed = []
+  directory = _GetSharedDirectory()
+  for name in os.listdir(directory):
+    if not name.startswith(PREFIX):
+      continue
+    try:
+      pid, start_time, _ = name[len(PREFIX):].split('_')
+      pid, start_time = int(pid), int(start_time)
+    except ValueError:
+      continue
+    if not _IsAlive(pid, start_time):
+      try:
+        os.unlink(os.path.join(directory, name))
+      except OSError:
+        continue
+      removed.append(name)
+  return removed
@@ -0,0 +1,290 @@
+"""NES Sprite Reader - Propose metasprites from how tiles fit together.
+
+The definitions in roms/smb3/smb3_sprites.py were put together by hand, by
+looking for tiles whose edges line up. This automates that process:
+
+  1. Each tile gets four edge signatures (its left and right columns and its
+     top and bottom rows), stored as 8-bit masks of the pixels that are
+     non-transparent and of the pixels of each color (1-3).
+  2. Every pair of tiles is scored on how well one continues the other, to the
+     right and downwards. Of the pixels along the shared edge that are
+     non-transparent in either tile, a pixel scores 1 if both tiles have the
+     same color there and 0.5 if both have a (different) non-transparent
+     color. The score is the average over those pixels.
+  3. Starting from the best scoring pairs, tiles are greedily placed next to
+     each other into groups, which are then emitted as nested tuples.
+
+To score all pairs quickly, the masks of all tiles are packed into the 8-bit
+lanes of a single long integer. Comparing one tile against every other tile is
+then a handful of long integer operations, with the bits counted in every lane
+at once (a 'SWAR' popcount).
+"""
+
+import binascii
+
+
+DIRECTION_RIGHT = 'right'
+DIRECTION_DOWN = 'down'
+
+DEFAULT_THRESHOLD = 0.75
+DEFAULT_MAX_WIDTH = 4
+DEFAULT_MAX_HEIGHT = 4
+
+# Pairs need at least this many non-transparent pixels along the shared edge to
+# be scored at all.
+MIN_EDGE_PIXELS = 2
+
+
+def _EdgeMasks(edge):
+  """Convert an edge (8 values from '0'-'3') into masks.
+
+  Args:
+    edge: A string of 8 pixel values.
+
+  Returns:
+    A tuple of the form (non_transparent, color_1, color_2, color_3), where each
+        element is an 8-bit mask of the pixels matching it.
+  """
+  masks = [0, 0, 0, 0]
+  for position, value in enumerate(edge):
+    if value != '0':
+      masks[0] |= 1 << position
+      masks[int(value)] |= 1 << position
+  return tuple(masks)
+
+
+def _GetEdges(tile):
+  """Return the (left, right, top, bottom) edges of a decoded tile."""
+  return (
+      ''.join(row[0] for row in tile),
+      ''.join(row[7] for row in tile),
+      tile[0],
+      tile[7],
+  )
+
+
+def _Pack(values):
+  """Pack a list of 8-bit values into the lanes of a long integer."""
+  if not values:
+    return 0
+  return int(binascii.hexlify(str(bytearray(values))), 16)
+
+
+def _Unpack(value, count):
+  """Unpack the 8-bit lanes of a long integer into a bytearray."""
+  return bytearray(
+      binascii.unhexlify('{:0{width}x}'.format(value, width=count*2)))
+
+
+class _LaneConstants(object):
+  """Constants for SWAR operations over a given number of 8-bit lanes."""
+
+  def __init__(self, count):
+    self.count = count
+    self.ones = _Pack([0x01] * count)
+    self.m55 = self.ones * 0x55
+    self.m33 = self.ones * 0x33
+    self.m0f = self.ones * 0x0f
+
+  def PopCount(self, value):
+    """Count the set bits in every lane of value."""
+    value -= (value >> 1) & self.m55
+    value = (value & self.m33) + ((value >> 2) & self.m33)
+    value = (value + (value >> 4)) & self.m0f
+    return _Unpack(value, self.count)
+
+
+def _ScoreDirection(first_edges, second_edges, lanes, threshold, direction):
+  """Score how well every tile's edge continues into every other tile's edge.
+
+  Args:
+    first_edges: A list of edge masks (see _EdgeMasks), one per tile, of the
+        edge facing the second tile (e.g. the right column).
+    second_edges: A list of edge masks, one per tile, of the edge facing the
+        first tile (e.g. the left column).
+    lanes: The _LaneConstants for the number of tiles.
+    threshold: The minimum score for a pair to be returned.
+    direction: The direction to record for each pair.
+
+  Returns:
+    A list of (score, first, second, direction) tuples.
+  """
+  packed = [
+      _Pack([masks[index] for masks in second_edges]) for index in xrange(4)]
+  packed_non_transparent = packed[0]
+
+  pairs = []
+  for first, masks in enumerate(first_edges):
+    if not masks[0]:
+      continue
+
+    equal = 0
+    for color in xrange(1, 4):
+      if masks[color]:
+        equal |= (masks[color] * lanes.ones) & packed[color]
+    non_transparent = masks[0] * lanes.ones
+    both = non_transparent & packed_non_transparent
+    either = non_transparent | packed_non_transparent
+
+    for second, (matching, shared, total) in enumerate(zip(
+        lanes.PopCount(equal), lanes.PopCount(both), lanes.PopCount(either))):
+      if total < MIN_EDGE_PIXELS or first == second:
+        continue
+      score = (matching + shared) / (2.0 * total)
+      if score >= threshold:
+        pairs.append((score, first, second, direction))
+
+  return pairs
+
+
+def ScoreAdjacency(tiles, threshold=DEFAULT_THRESHOLD):
+  """Score every pair of tiles on how well they continue each other.
+
+  Args:
+    tiles: A list of decoded tiles (e.g. NESSpriteReader.sprites, or a slice
+        of it holding a single bank).
+    threshold: The minimum score (0-1) for a pair to be returned.
+
+  Returns:
+    A list of (score, first, second, direction) tuples, best first, where
+        direction is DIRECTION_RIGHT if second continues to the right of first,
+        or DIRECTION_DOWN if it continues below it.
+  """
+  tiles = list(tiles)
+  edges = [[_EdgeMasks(edge) for edge in _GetEdges(tile)] for tile in tiles]
+  lefts, rights, tops, bottoms = (
+      [tile_edges[side] for tile_edges in edges] for side in xrange(4))
+
+  lanes = _LaneConstants(len(tiles))
+  pairs = (
+      _ScoreDirection(rights, lefts, lanes, threshold, DIRECTION_RIGHT) +
+      _ScoreDirection(bottoms, tops, lanes, threshold, DIRECTION_DOWN))
+  pairs.sort(key=lambda pair: -pair[0])
+  return pairs
+
+
+def ProposeMetasprites(tiles, threshold=DEFAULT_THRESHOLD,
+                       max_width=DEFAULT_MAX_WIDTH,
+                       max_height=DEFAULT_MAX_HEIGHT, blank_tile=None,
+                       first_tile=0):
+  """Propose metasprites by greedily joining the best fitting tiles.
+
+  Args:
+    tiles: A list of decoded tiles (see ScoreAdjacency).
+    threshold: The minimum score (0-1) for two tiles to be joined.
+    max_width: The maximum width (in tiles) of a metasprite.
+    max_height: The maximum height (in tiles) of a metasprite.
+    blank_tile: The tile index used to fill gaps in a metasprite (e.g. 30 for
+        Super Mario Bros. 3). If not provided, the first fully transparent
+        tile is used.
+    first_tile: The tile index of tiles[0], which is added to every index in
+        the proposed metasprites.
+
+  Returns:
+    A list of metasprites, each in the nested tuple format used in
+        roms/smb3/smb3_sprites.py.
+
+  Raises:
+    ValueError: No blank_tile was given and there is no transparent tile.
+  """
+  tiles = list(tiles)
+  if blank_tile is None:
+    for index, tile in enumerate(tiles):
+      if not ''.join(tile).strip('0'):
+        blank_tile = first_tile + index
+        break
+    else:
+      raise ValueError('No transparent tile to fill gaps with.')
+
+  # For each placed tile, the group it is in and its (x, y) within the group.
+  placements = {}
+  groups = {}
+  next_group = 0
+
+  for _, first, second, direction in ScoreAdjacency(tiles, threshold):
+    d_x, d_y = (1, 0) if direction == DIRECTION_RIGHT else (0, 1)
+
+    if first not in placements and second not in placements:
+      groups[next_group] = {(0, 0): first, (d_x, d_y): second}
+      placements[first] = (next_group, 0, 0)
+      placements[second] = (next_group, d_x, d_y)
+      next_group += 1
+      continue
+
+    if first in placements and second in placements:
+      group_a, x_a, y_a = placements[first]
+      group_b, x_b, y_b = placements[second]
+      if group_a == group_b:
+        continue
+      # Move the second group so that second ends up next to first.
+      shift_x, shift_y = x_a + d_x - x_b, y_a + d_y - y_b
+      moved = dict(
+          ((x + shift_x, y + shift_y), tile)
+          for (x, y), tile in groups[group_b].iteritems())
+      merged = dict(groups[group_a])
+      if set(moved) & set(merged):
+        continue
+      merged.update(moved)
+      if not _FitsWithin(merged, max_width, max_height):
+        continue
+      groups[group_a] = merged
+      del groups[group_b]
+      for (x, y), tile in moved.iteritems():
+        placements[tile] = (group_a, x, y)
+      continue
+
+    # Exactly one of the tiles is placed; place the other next to it.
+    if first in placements:
+      group, x, y = placements[first]
+      new_tile, position = second, (x + d_x, y + d_y)
+    else:
+      group, x, y = placements[second]
+      new_tile, position = first, (x - d_x, y - d_y)
+    if position in groups[group]:
+      continue
+    grown = dict(groups[group])
+    grown[position] = new_tile
+    if not _FitsWithin(grown, max_width, max_height):
+      continue
+    groups[group] = grown
+    placements[new_tile] = (group,) + position
+
+  metasprites = []
+  for group in sorted(groups.itervalues(), key=lambda g: min(g.values())):
+    xs = [x for x, _ in group]
+    ys = [y for _, y in group]
+    metasprites.append(tuple(
+        tuple(
+            first_tile + group[(x, y)] if (x, y) in group else blank_tile
+            for x in xrange(min(xs), max(xs) + 1))
+        for y in xrange(min(ys), max(ys) + 1)))
+  return metasprites
+
+
+def _FitsWithin(group, max_width, max_height):
+  """Determine whether a group of placed tiles fits within the maximum size."""
+  xs = [x for x, _ in group]
+  ys = [y for _, y in group]
+  return (max(xs) - min(xs) < max_width) and (max(ys) - min(ys) < max_height)
+
+
+def FormatDefinitions(metasprites, prefix='SPRITE'):
+  """Format metasprites as Python source, in the style of smb3_sprites.py.
+
+  Args:
+    metasprites: A list of metasprites (nested tuples of tile indices).
+    prefix: The prefix of each definition's name, which is followed by the
+        index of the metasprite.
+
+  Returns:
+    A string containing one definition per metasprite.
+  """
+  definitions = []
+  for index, metasprite in enumerate(metasprites):
+    lines = ['{}_{} = ('.format(prefix, index)]
+    for row in metasprite:
+      lines.append('  ({}{}),'.format(
+          ', '.join(str(tile) for tile in row), ',' if len(row) == 1 else ''))
+    lines.append(')')
+    definitions.append('\n'.join(lines))
+  return '\n\n'.join(definitions) + '\n'
@@ -0,0 +1,180 @@
+"""NES Sprite Reader - Locate tile graphics stored in PRG ROM.
+
+Games without CHR ROM (chr_banks == 0) use CHR RAM, which the game fills at
+runtime from data stored in PRG ROM. That data is frequently uncompressed, so it
+can be found by scanning PRG for stretches that 'look like' 2bpp tiles.
+
+Each 16-byte window (a potential tile) is scored on three signals:
+
+  * Plane correlation: The two 8-byte bit planes of real tiles tend to share
+    most of their bits (e.g. outlines drawn in color 3, or an empty plane),
+    whereas code and random data agree on roughly half of them.
+  * Row repetition: Adjacent rows of a tile are often identical.
+  * Byte diversity (a cheap stand-in for entropy): Tiles are built from a
+    handful of distinct row patterns, while code uses many distinct bytes.
+
+Windows containing a single repeated byte (blank tiles, or 0x00/0xff padding)
+are ambiguous, so they are neutral: they neither start nor end a region, but
+a region can run across any number of them (CHR banks are full of blank
+tiles). Trailing ones are left out of a region.
+
+Rather than looping over the bit planes in Python, all windows are processed at
+once: the planes are gathered into long strings, XORed together as long
+integers and then counted with str.translate lookup tables, leaving a single
+cheap pass to sum the per-window counts.
+"""
+
+import binascii
+
+
+TILE_SIZE = 16
+PLANE_SIZE = 8
+
+DEFAULT_THRESHOLD = 0.45
+DEFAULT_MIN_TILES = 8
+DEFAULT_MAX_GAP = 4
+
+# Translation tables mapping each byte to its number of set bits, and to whether
+# it is zero.
+_POPCOUNT_TABLE = ''.join(chr(bin(value).count('1')) for value in xrange(256))
+_IS_ZERO_TABLE = '\x01' + '\x00'*255
+
+
+def _XorStrings(str_1, str_2):
+  """XOR two equal-length byte strings in a single operation.
+
+  Args:
+    str_1: A byte string.
+    str_2: A byte string of the same length as str_1.
+
+  Returns:
+    A byte string containing the bytewise XOR of the two inputs.
+  """
+  if not str_1:
+    return ''
+  value = (int(binascii.hexlify(str_1), 16) ^
+           int(binascii.hexlify(str_2), 16))
+  return binascii.unhexlify('{:0{width}x}'.format(value, width=len(str_1)*2))
+
+
+def _GatherRows(data, first_row, last_row):
+  """Gather the same rows of every tile in data into a single string.
+
+  Args:
+    data: A byte string whose length is a multiple of TILE_SIZE.
+    first_row: The offset of the first byte to take from each tile.
+    last_row: The offset just past the last byte to take from each tile.
+
+  Returns:
+    A byte string with data[tile+first_row:tile+last_row] for each tile.
+  """
+  return ''.join(
+      data[index+first_row:index+last_row]
+      for index in xrange(0, len(data), TILE_SIZE))
+
+
+def ScoreTileWindows(data):
+  """Score every 16-byte window of data as plausible 2bpp tile data.
+
+  Args:
+    data: A byte string to scan. Any trailing partial window is ignored.
+
+  Returns:
+    A list with one float score (between 0 and 1) per 16-byte window, where
+        higher scores are more likely to be tile data, or None for windows of
+        a single repeated byte (which could be either).
+  """
+  data = data[:len(data) - len(data) % TILE_SIZE]
+  tile_count = len(data) // TILE_SIZE
+
+  # Bits that differ between the two planes of each tile (8 bytes per tile).
+  plane_a = _GatherRows(data, 0, PLANE_SIZE)
+  plane_b = _GatherRows(data, PLANE_SIZE, TILE_SIZE)
+  plane_diff = bytearray(_XorStrings(plane_a, plane_b).translate(
+      _POPCOUNT_TABLE))
+
+  # Rows equal to the row below them, for both planes (7 + 7 bytes per tile).
+  upper = (_GatherRows(data, 0, PLANE_SIZE-1) +
+           _GatherRows(data, PLANE_SIZE, TILE_SIZE-1))
+  lower = (_GatherRows(data, 1, PLANE_SIZE) +
+           _GatherRows(data, PLANE_SIZE+1, TILE_SIZE))
+  repeats = bytearray(_XorStrings(upper, lower).translate(_IS_ZERO_TABLE))
+  repeats_b_start = tile_count * (PLANE_SIZE-1)
+
+  max_bits = float(PLANE_SIZE*8)
+  max_repeats = float((PLANE_SIZE-1)*2)
+  max_distinct = float(TILE_SIZE-1)
+
+  scores = []
+  for tile in xrange(tile_count):
+    window = data[tile*TILE_SIZE:(tile+1)*TILE_SIZE]
+    distinct = len(set(window))
+    if distinct == 1:
+      scores.append(None)
+      continue
+
+    row_start = tile*(PLANE_SIZE-1)
+    differing_bits = sum(plane_diff[tile*PLANE_SIZE:(tile+1)*PLANE_SIZE])
+    correlation = 1 - differing_bits/max_bits
+    repetition = (
+        sum(repeats[row_start:row_start+PLANE_SIZE-1]) +
+        sum(repeats[repeats_b_start+row_start:
+                    repeats_b_start+row_start+PLANE_SIZE-1])) / max_repeats
+    diversity = 1 - (distinct-1)/max_distinct
+    scores.append((correlation + repetition + diversity) / 3)
+
+  return scores
+
+
+def FindTileRegions(data, threshold=DEFAULT_THRESHOLD,
+                    min_tiles=DEFAULT_MIN_TILES, max_gap=DEFAULT_MAX_GAP):
+  """Find the regions of data that are likely to contain tile graphics.
+
+  Args:
+    data: A byte string to scan.
+    threshold: The minimum score for a window to count as tile data.
+    min_tiles: The minimum number of tiles in a region (shorter regions are
+        discarded).
+    max_gap: The number of consecutive low-scoring windows that may be bridged
+        within a single region. Windows of a single repeated byte don't count
+        towards this.
+
+  Returns:
+    A list of (start, end) tuples of offsets into data, each a multiple of 16.
+
+  A bank of tiles in groups of 6, each followed by a run of 5 blank tiles, is
+  found as a single region (without the final blank run), even when
+  surrounded by code (run python -m doctest tile_detector.py to check):
+
+    >>> rows = [0x18, 0x3c, 0x7e, 0xff, 0xff, 0x7e, 0x3c, 0x18]
+    >>> tile = str(bytearray(rows*2))
+    >>> blank = str(bytearray(TILE_SIZE))
+    >>> code = str(bytearray(index*97 % 251 for index in xrange(1600)))
+    >>> FindTileRegions(code + (tile*6 + blank*5)*10 + code)
+    [(1600, 3280)]
+  """
+  regions = []
+  start = end = None
+  gap = 0
+  for tile, score in enumerate(ScoreTileWindows(data)):
+    if score is None:
+      continue
+    if score < threshold:
+      gap += 1
+      if start is not None and gap > max_gap:
+        regions.append((start, end))
+        start = None
+      continue
+    if start is None:
+      start = tile
+    end = tile + 1
+    gap = 0
+
+  if start is not None:
+    regions.append((start, end))
+
+  return [
+      (start*TILE_SIZE, end*TILE_SIZE)
+      for start, end in regions
+      if end - start >= min_tiles
+  ]